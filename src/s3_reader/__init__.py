@@ -1,9 +1,14 @@
 __version__ = "0.0.2"
 
+from ._async import (
+    async_download_by_keys, async_list_keys_by_prefixes,
+    download_by_keys_async, list_keys_by_prefixes_async
+)
 from .main import main
 from .s3_reader import (
-    download_by_key, download_by_keys,
-    list_keys_by_prefix, list_keys_by_prefixes,
+    close_ndjson_shards, download_by_key, download_by_keys,
+    download_large_by_key, download_large_by_keys,
+    iter_keys_by_prefix, list_keys_by_prefix, list_keys_by_prefix_sharded, list_keys_by_prefixes,
     list_prefixes_by_prefix, list_prefixes_by_prefixes
 )
 
@@ -12,8 +17,17 @@ __all__ = [
     "main",
     "list_prefixes_by_prefix",
     "list_prefixes_by_prefixes",
+    "iter_keys_by_prefix",
     "list_keys_by_prefix",
+    "list_keys_by_prefix_sharded",
     "list_keys_by_prefixes",
     "download_by_key",
     "download_by_keys",
+    "close_ndjson_shards",
+    "download_large_by_key",
+    "download_large_by_keys",
+    "async_list_keys_by_prefixes",
+    "async_download_by_keys",
+    "list_keys_by_prefixes_async",
+    "download_by_keys_async",
 ]
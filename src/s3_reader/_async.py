@@ -0,0 +1,186 @@
+import asyncio
+import os
+from typing import Literal
+
+from .s3_reader import (
+    _get_key, _json_loads, _makedirs, _open_part,
+    AWS_PROFILE_NAME, AWS_REGION_NAME, create_s3_config, MB, progress_bar
+)
+
+MAX_CONCURRENCY = 64
+
+
+def create_s3_session():
+    """
+    Create an aioboto3 session, aioboto3 is an optional dependency, install it with `pip install s3_reader[async]`.
+    aioboto3 is imported here rather than at module level, so importing s3_reader does not pay for aiohttp.
+    :return: session: aioboto3.Session
+    """
+    try:
+        import aioboto3
+    except ImportError as err:
+        raise ImportError('aioboto3 is required for async functions, '
+                          'install it with "pip install s3_reader[async]"') from err
+    return aioboto3.Session(profile_name=AWS_PROFILE_NAME, region_name=AWS_REGION_NAME)
+
+
+async def _list_keys_by_prefix(client, bucket: str, prefix: str) -> list[str]:
+    """
+    List keys in a S3 bucket with a single file prefix with an aioboto3 client.
+    :param client: aioboto3 S3 client
+    :param bucket: AWS S3 Bucket
+    :param prefix: AWS S3 file prefix
+    :return: list of AWS S3 files' full path
+    """
+    try:
+        paginator = client.get_paginator('list_objects_v2')
+        pages = paginator.paginate(Bucket=bucket, Prefix=prefix, PaginationConfig={'PageSize': 1000})
+        keys: list[str] = []
+        async for page in pages:
+            keys.extend(map(_get_key, page.get('Contents', ())))
+        return keys
+    except Exception as err:
+        print(f'Error {err}')
+        return []
+
+
+async def _download_by_key(
+        client,
+        bucket: str,
+        key: str,
+        output_format: Literal['dict', 'bytes'] = 'dict',
+        output_dir: str | None = '',
+) -> tuple[str, dict | bytes | int] | None:
+    """
+    Download one AWS S3 file per the bucket and key (file full path) with an aioboto3 client.
+    File writes run in a thread via asyncio.to_thread, so a slow disk does not block the event loop.
+    :param client: aioboto3 S3 client
+    :param bucket: AWS S3 Bucket
+    :param key: AWS S3 file path
+    :param output_format: dict or bytes
+    :param output_dir: write to a directory if not None
+    :return: tuple of (key, data), data is the number of bytes written if output_dir is not None, None if failed
+    """
+    try:
+        resp = await client.get_object(Bucket=bucket, Key=key)
+        async with resp['Body'] as body:
+            if output_format == 'dict':
+                return key, _json_loads(await body.read())
+            elif output_format == 'bytes':
+                if output_dir is None:
+                    return key, await body.read()
+                await asyncio.to_thread(_makedirs, os.path.join(output_dir, os.path.dirname(key)))
+                with _open_part(os.path.join(output_dir, key)) as f:
+                    async for chunk in body.iter_chunks(MB):
+                        await asyncio.to_thread(f.write, chunk)
+                    return key, f.tell()
+            else:
+                raise ValueError('output_format must be "dict" or "bytes"')
+    except Exception as err:
+        print(err)
+        return
+
+
+async def async_list_keys_by_prefixes(
+        bucket: str,
+        prefixes: list[str],
+        max_concurrency: int = MAX_CONCURRENCY,
+) -> list[str]:
+    """
+    List keys in a S3 bucket with multiple file prefixes on a single event loop.
+    All prefixes share one client, a semaphore bounds the number of in-flight requests.
+    :param bucket: AWS S3 Bucket
+    :param prefixes: list of AWS S3 file prefix
+    :param max_concurrency: max number of in-flight requests
+    :return: list of AWS S3 files' full path
+    """
+    keys = []
+    if len(prefixes) > 0:
+        session = create_s3_session()
+        sem = asyncio.Semaphore(max_concurrency)
+        async with session.client('s3', config=create_s3_config(max_concurrency)) as client:
+            async def bound(prefix: str) -> list[str]:
+                async with sem:
+                    return await _list_keys_by_prefix(client, bucket, prefix)
+
+            jobs = [bound(prefix) for prefix in prefixes]
+            for job in progress_bar(asyncio.as_completed(jobs), total=len(prefixes), desc='List keys by prefixes'):
+                keys.extend(await job)
+    return keys
+
+
+async def async_download_by_keys(
+        bucket: str,
+        keys: list[str],
+        output_format: Literal['dict', 'bytes'] = 'dict',
+        output_dir: str | None = '',
+        max_concurrency: int = MAX_CONCURRENCY,
+) -> dict[str, dict | bytes | int | None]:
+    """
+    Download many AWS S3 files per the bucket and keys (file full path) on a single event loop.
+    All keys share one client, max_concurrency workers take the keys one by one,
+    so only max_concurrency GET requests and tasks exist at the same time regardless of the number of keys.
+    Return a dict in the order of keys, the value is None if the download failed, same as download_by_keys.
+    The ndjson output_format of download_by_keys is not supported.
+    :param bucket: AWS S3 Bucket
+    :param keys: list of AWS S3 file paths
+    :param output_format: dict or bytes
+    :param output_dir: write to a directory if not None
+    :param max_concurrency: max number of in-flight requests
+    :return: dict of {key: data}
+    """
+    if output_format not in ('dict', 'bytes'):
+        raise ValueError('output_format must be "dict" or "bytes" for async download')
+    data = dict.fromkeys(keys)
+    if len(keys) > 0:
+        session = create_s3_session()
+        keys_iter = iter(keys)
+        async with session.client('s3', config=create_s3_config(max_concurrency)) as client:
+            with progress_bar(total=len(keys), desc='Download file by keys') as progress:
+                async def worker():
+                    for key in keys_iter:
+                        result = await _download_by_key(client, bucket, key,
+                                                        output_format=output_format, output_dir=output_dir)
+                        if result is not None:
+                            data[key] = result[1]
+                        progress.update()
+
+                await asyncio.gather(*(worker() for _ in range(max(1, min(max_concurrency, len(keys))))))
+    return data
+
+
+def list_keys_by_prefixes_async(
+        bucket: str,
+        prefixes: list[str],
+        max_concurrency: int = MAX_CONCURRENCY,
+) -> list[str]:
+    """
+    Sync wrapper of async_list_keys_by_prefixes, returns the same keys as list_keys_by_prefixes,
+    in completion order of the prefixes.
+    :param bucket: AWS S3 Bucket
+    :param prefixes: list of AWS S3 file prefix
+    :param max_concurrency: max number of in-flight requests
+    :return: list of AWS S3 files' full path
+    """
+    return asyncio.run(async_list_keys_by_prefixes(bucket, prefixes, max_concurrency=max_concurrency))
+
+
+def download_by_keys_async(
+        bucket: str,
+        keys: list[str],
+        output_format: Literal['dict', 'bytes'] = 'dict',
+        output_dir: str | None = '',
+        max_concurrency: int = MAX_CONCURRENCY,
+) -> dict[str, dict | bytes | int | None]:
+    """
+    Sync wrapper of async_download_by_keys, same arguments and result as download_by_keys,
+    except the ndjson output_format is not supported.
+    :param bucket: AWS S3 Bucket
+    :param keys: list of AWS S3 file paths
+    :param output_format: dict or bytes
+    :param output_dir: write to a directory if not None
+    :param max_concurrency: max number of in-flight requests
+    :return: dict of {key: data}
+    """
+    return asyncio.run(async_download_by_keys(bucket, keys, output_format=output_format,
+                                              output_dir=output_dir, max_concurrency=max_concurrency))
@@ -19,6 +19,8 @@ def main():
     parser_download_group.add_argument('-k', '--keys', nargs='+', help='AWS file key name')
     parser_download_group.add_argument('-p', '--prefixes', nargs='+', help='AWS file prefix name')
     parser_download.add_argument('-d', '--output_dir', default='', help='Download target directory')
+    parser_download.add_argument('-f', '--output_format', choices=['bytes', 'ndjson'], default='bytes',
+                                 help='write each file as is, or append to ndjson shard files, default bytes')
 
     args = parser.parse_args()
 
@@ -40,14 +42,14 @@ def main():
             download_by_keys(
                 bucket=args.bucket,
                 keys=args.keys,
-                output_format='bytes',
+                output_format=args.output_format,
                 output_dir=args.output_dir,
             )
         elif args.prefixes:
             download_by_prefixes(
                 bucket=args.bucket,
                 prefixes=args.prefixes,
-                output_format='bytes',
+                output_format=args.output_format,
                 output_dir=args.output_dir,
             )
         else:
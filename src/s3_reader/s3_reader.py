@@ -1,31 +1,314 @@
+import atexit
 import json
 import os
-from concurrent.futures import as_completed, ThreadPoolExecutor
+import shutil
+import string
+import sys
+import threading
+from concurrent.futures import as_completed, FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager, suppress
 from functools import partial
-from io import BytesIO
-from typing import Callable, Literal
+from itertools import islice
+from operator import itemgetter
+from queue import Queue
+from typing import BinaryIO, Callable, Iterable, Iterator, Literal
 
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from dotenv import load_dotenv
 from mypy_boto3_s3 import S3Client
 from tqdm import tqdm
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 load_dotenv()
 
+
+def _getenv_int(name: str, default: int) -> int:
+    """
+    Read a positive integer from an environment variable, fall back to the default if it is not an integer.
+    :param name: environment variable name
+    :param default: default value
+    :return: value, at least 1
+    """
+    value = os.getenv(name)
+    try:
+        return max(1, int(value)) if value is not None else default
+    except ValueError:
+        print(f'Invalid {name}={value!r}, use {default}')
+        return default
+
+
 AWS_PROFILE_NAME = os.getenv('AWS_PROFILE_NAME', 'default')
 AWS_REGION_NAME = os.getenv('AWS_REGION_NAME', 'cn-north-1')
+MAX_WORKERS = _getenv_int('S3_READER_WORKERS', 64)
+USE_ORJSON = orjson is not None and os.getenv('S3_READER_ORJSON', '').lower() in ('1', 'true', 'yes')
+MB = 1 << 20
+MIN_PROGRESS_JOBS = 32
+
+_get_key = itemgetter('Key')
+_get_prefix = itemgetter('Prefix')
+
+_SESSION: boto3.Session | None = None
+_SESSION_LOCK = threading.Lock()
+_CLIENT_CACHE: dict[tuple[str, str, int], S3Client] = {}
+_CLIENT_LOCK = threading.Lock()
+_MKDIR_SEEN: set[str] = set()
+_MKDIR_LOCK = threading.Lock()
+_NDJSON_SHARDS: dict[tuple[str, int], BinaryIO] = {}
+_NDJSON_LOCK = threading.Lock()
+
+
+def progress_bar(iterable: Iterable | None = None, total: int | None = None, desc: str | None = None) -> tqdm:
+    """
+    Create a tqdm progress bar, disabled when stderr is not a terminal or there are too few jobs to show progress,
+    so piped or logged runs do not pay for the progress bar lock and writes on every completed job.
+    :param iterable: iterable to wrap
+    :param total: number of jobs, None if unknown
+    :param desc: description of the progress bar
+    :return: tqdm progress bar
+    """
+    disable = not sys.stderr.isatty() or (total is not None and total < MIN_PROGRESS_JOBS)
+    return tqdm(iterable, total=total, desc=desc, disable=disable, mininterval=0.5)
+
+
+def _json_loads(data: bytes):
+    """
+    Decode JSON bytes with the stdlib json module, or with orjson when it is installed and S3_READER_ORJSON is set.
+    orjson falls back to the stdlib json module for payloads it rejects,
+    such as NaN and Infinity which json.dumps writes by default.
+    Note that orjson decodes integers of 2 ** 64 or more as float, while the stdlib json keeps them as int,
+    so orjson is opt-in rather than used whenever it is installed.
+    :param data: JSON bytes
+    :return: decoded object
+    """
+    if USE_ORJSON:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(data)
+
+
+def _json_compact(data: bytes) -> bytes:
+    """
+    Rewrite multi-line JSON bytes on a single line.
+    Only the stdlib json module is used, it keeps NaN, Infinity and big integers exactly as they are,
+    orjson would turn them into null and float.
+    :param data: JSON bytes
+    :return: JSON bytes without newlines
+    """
+    return json.dumps(json.loads(data), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def _check_output(output_format: str, output_dir: str | None):
+    """
+    Check output_format and output_dir before any request is sent.
+    :param output_format: dict, bytes or ndjson
+    :param output_dir: write to a directory if not None
+    """
+    if output_format not in ('dict', 'bytes', 'ndjson'):
+        raise ValueError('output_format must be "dict", "bytes" or "ndjson"')
+    if output_format == 'ndjson' and output_dir is None:
+        raise ValueError('output_dir is required when output_format is "ndjson"')
+
+
+def _pick_workers(n_jobs: int, max_pool_connections: int = MAX_WORKERS) -> int:
+    """
+    Pick the number of worker threads, no more than the jobs, the connections in the pool and MAX_WORKERS.
+    :param n_jobs: number of jobs
+    :param max_pool_connections: max number of connections the workers share
+    :return: number of worker threads
+    """
+    return max(1, min(n_jobs, max_pool_connections, MAX_WORKERS))
+
+
+def get_session() -> boto3.Session:
+    """
+    Get the shared boto3 session, create it on first use.
+    Creating a session loads the AWS config files, credential providers and service data,
+    so it is done once per process instead of once per client.
+    :return: session: boto3.Session
+    """
+    global _SESSION
+    with _SESSION_LOCK:
+        if _SESSION is None:
+            _SESSION = boto3.Session(profile_name=AWS_PROFILE_NAME, region_name=AWS_REGION_NAME)
+        return _SESSION
+
+
+def _map_bounded(
+        executor: ThreadPoolExecutor,
+        func: Callable,
+        items: Iterable,
+        max_inflight: int,
+) -> Iterator[tuple]:
+    """
+    Run func on each item in the executor, keep at most max_inflight futures at the same time,
+    submit the next items only as earlier ones complete, so memory does not grow with the number of items.
+    :param executor: ThreadPoolExecutor
+    :param func: function to call on each item
+    :param items: items to process
+    :param max_inflight: max number of submitted but not yet consumed futures
+    :return: iterator of (item, result) in completion order
+    """
+    items = iter(items)
+    inflight = {executor.submit(func, item): item for item in islice(items, max_inflight)}
+    while inflight:
+        done, _ = wait(inflight, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield inflight.pop(future), future.result()
+            for item in islice(items, 1):
+                inflight[executor.submit(func, item)] = item
+
 
+def _makedirs(directory: str):
+    """
+    Create a directory and its parents once per process, many keys share the same dirname,
+    so skip the makedirs syscalls for directories already created.
+    :param directory: directory path, the current working directory if empty
+    """
+    if not directory or directory in _MKDIR_SEEN:
+        return
+    with _MKDIR_LOCK:
+        if directory not in _MKDIR_SEEN:
+            os.makedirs(directory, exist_ok=True)
+            _MKDIR_SEEN.add(directory)
+
+
+def _open(path: str, mode: str) -> BinaryIO:
+    """
+    Open a file whose directory was created by _makedirs. If the directory was removed since it was cached,
+    forget it, create it again and retry once, so a long-lived process recovers when the output is cleaned up.
+    :param path: file path
+    :param mode: binary file mode
+    :return: opened file
+    """
+    try:
+        return open(path, mode)
+    except FileNotFoundError:
+        directory = os.path.dirname(path)
+        with _MKDIR_LOCK:
+            _MKDIR_SEEN.discard(directory)
+        _makedirs(directory)
+        return open(path, mode)
+
+
+@contextmanager
+def _open_part(path: str) -> Iterator[BinaryIO]:
+    """
+    Open a temporary path + '.part' file for writing, move it to path only when the block succeeds,
+    so a download which fails halfway never leaves a truncated file under the real key name.
+    :param path: final file path
+    :return: temporary file opened in binary write mode
+    """
+    part = path + '.part'
+    try:
+        with _open(part, 'wb') as f:
+            yield f
+        os.replace(part, path)
+    except BaseException:
+        with suppress(FileNotFoundError):
+            os.remove(part)
+        raise
+
+
+def _get_ndjson_shard(output_dir: str) -> BinaryIO:
+    """
+    Get the ndjson shard file of the current thread in the output directory, open it in append mode on first use.
+    Each thread writes only to its own shard, so no lock is needed for writing.
+    Shards are named after the thread id and never truncated, so a rerun into the same directory appends
+    the records again, to the same or new shard files. Clear the directory before a rerun to avoid duplicates.
+    :param output_dir: directory of the shard files
+    :return: shard file opened in binary append mode
+    """
+    shard_key = (output_dir, threading.get_ident())
+    f = _NDJSON_SHARDS.get(shard_key)
+    if f is None:
+        _makedirs(output_dir)
+        f = _open(os.path.join(output_dir, f'shard_{shard_key[1]}.ndjson'), 'ab')
+        with _NDJSON_LOCK:
+            _NDJSON_SHARDS[shard_key] = f
+    return f
+
+
+@atexit.register
+def close_ndjson_shards(output_dir: str | None = None):
+    """
+    Close the ndjson shard files in output_dir, called when a batch download finishes,
+    shards of other output directories may still be written by other batches and stay open.
+    Close all shard files if output_dir is None, which is done at interpreter exit.
+    :param output_dir: directory of the shard files, all directories if None
+    """
+    with _NDJSON_LOCK:
+        for shard_key in [shard_key for shard_key in _NDJSON_SHARDS if output_dir in (None, shard_key[0])]:
+            _NDJSON_SHARDS.pop(shard_key).close()
+
+
+def create_s3_config(max_pool_connections: int = MAX_WORKERS) -> Config:
+    """
+    Create the botocore config shared by the sync and async clients.
+    TCP keep-alive stops idle pooled sockets from being silently dropped by NAT or load balancers,
+    short connect and read timeouts fail fast on dead sockets and let the adaptive retries take over.
+    :param max_pool_connections: max number of connections kept in the pool
+    :return: config: Config
+    """
+    return Config(
+        max_pool_connections=max_pool_connections,
+        retries={'mode': 'adaptive', 'max_attempts': 5},
+        tcp_keepalive=True,
+        connect_timeout=5,
+        read_timeout=60,
+    )
 
-def create_s3_client() -> S3Client:
+
+def create_s3_client(max_pool_connections: int = MAX_WORKERS) -> S3Client:
     """
     Create an AWS S3 client.
+    The connection pool is sized to the number of concurrent workers,
+    so each worker thread keeps its own connection instead of waiting for a free one.
+    A boto3 session is not thread-safe while clients are, so clients are created from the shared session under a lock.
+    :param max_pool_connections: max number of connections kept in the pool
     :return: client: S3Client
     """
-    session = boto3.Session(profile_name=AWS_PROFILE_NAME, region_name=AWS_REGION_NAME)
-    client: S3Client = session.client(service_name='s3', use_ssl=False, verify=False)
+    config = create_s3_config(max_pool_connections=max_pool_connections)
+    session = get_session()
+    with _SESSION_LOCK:
+        client: S3Client = session.client(service_name='s3', config=config, use_ssl=True)
     return client
 
 
+def get_s3_client(max_pool_connections: int = MAX_WORKERS) -> S3Client:
+    """
+    Get a shared AWS S3 client, create it on first use.
+    One client is cached per profile, region and pool size, boto3 clients are thread-safe,
+    so the batch functions reuse it instead of paying the cost of create and close a client per call.
+    :param max_pool_connections: max number of connections kept in the pool
+    :return: client: S3Client
+    """
+    cache_key = (AWS_PROFILE_NAME, AWS_REGION_NAME, max_pool_connections)
+    with _CLIENT_LOCK:
+        client = _CLIENT_CACHE.get(cache_key)
+        if client is None:
+            client = _CLIENT_CACHE[cache_key] = create_s3_client(max_pool_connections=max_pool_connections)
+        return client
+
+
+@atexit.register
+def close_s3_clients():
+    """
+    Close all cached AWS S3 clients, registered to run at interpreter exit.
+    """
+    with _CLIENT_LOCK:
+        for client in _CLIENT_CACHE.values():
+            client.close()
+        _CLIENT_CACHE.clear()
+
+
 def list_prefixes_by_prefix(
         client: S3Client,
         bucket: str,
@@ -33,20 +316,19 @@ def list_prefixes_by_prefix(
 ) -> list[str]:
     """
     List prefixes (next level folders) in a S3 bucket with a single file prefix, each key is a file's full path.
-    Each list_objects_v2 request returns max 1000 keys, so use a while loop to get all keys under the prefix.
+    Each list_objects_v2 request returns max 1000 keys, so use a paginator to get all prefixes under the prefix.
     :param client: S3Client
     :param bucket: AWS S3 Bucket
     :param prefix: AWS S3 file prefix
     :return: list of AWS S3 prefixes' full path
     """
     try:
-        resp = client.list_objects_v2(Bucket=bucket, Prefix=prefix, Delimiter='/')
-        prefixes: list[str] = [common_prefixes.get('Prefix') for common_prefixes in resp.get('CommonPrefixes', [])]
-
-        while continuation_token := resp.get('NextContinuationToken'):
-            resp = client.list_objects_v2(Bucket=bucket, Prefix=prefix, Delimiter='/',
-                                          ContinuationToken=continuation_token)
-            prefixes.extend(common_prefixes.get('Prefix') for common_prefixes in resp.get('CommonPrefixes', []))
+        paginator = client.get_paginator('list_objects_v2')
+        pages = paginator.paginate(Bucket=bucket, Prefix=prefix, Delimiter='/',
+                                   PaginationConfig={'PageSize': 1000})
+        prefixes: list[str] = []
+        for page in pages:
+            prefixes.extend(map(_get_prefix, page.get('CommonPrefixes', ())))
         return prefixes
     except Exception as err:
         print(f'Error {err}')
@@ -59,29 +341,57 @@ def list_prefixes_by_prefixes(
 ) -> list[str]:
     """
     List prefixes (next level folders) in a S3 bucket with multiple file prefixes.
-    Use concurrent with max 16 workers to speed up.
-    Reuse same client to avoid cost of create and close a client.
+    Use concurrent with max MAX_WORKERS workers to speed up.
+    Reuse the shared client to avoid cost of create and close a client.
     :param bucket: AWS S3 Bucket
     :param prefixes: list of AWS S3 file prefix
     :return: list of AWS S3 prefixes' full path
     """
     if len(prefixes) > 0:
-        client = create_s3_client()
-        try:
-            func: Callable = partial(list_prefixes_by_prefix, client, bucket)
-            max_workers = 16
-            sub_level_prefixes = []
-
-            with ThreadPoolExecutor(min(max_workers, len(prefixes))) as executor:
-                jobs = [executor.submit(func, prefix) for prefix in prefixes]
-                jobs_iter = tqdm(as_completed(jobs), total=len(prefixes), desc='List prefixes by prefixes')
-                for job in jobs_iter:
-                    sub_level_prefixes.extend(job.result())
-        finally:
-            client.close()
+        client = get_s3_client()
+        func: Callable = partial(list_prefixes_by_prefix, client, bucket)
+        sub_level_prefixes = []
+
+        with ThreadPoolExecutor(_pick_workers(len(prefixes))) as executor:
+            jobs = [executor.submit(func, prefix) for prefix in prefixes]
+            jobs_iter = progress_bar(as_completed(jobs), total=len(prefixes), desc='List prefixes by prefixes')
+            for job in jobs_iter:
+                sub_level_prefixes.extend(job.result())
         return sub_level_prefixes
 
 
+def iter_keys_by_prefix(
+        client: S3Client,
+        bucket: str,
+        prefix: str,
+        start_after: str | None = None,
+        end_at: str | None = None,
+) -> Iterator[str]:
+    """
+    Iterate keys in a S3 bucket with a single file prefix, each key is a file's full path.
+    Keys are yielded as soon as each page of max 1000 keys returns, without keeping all keys in memory.
+    Optionally only iterate the keys in range (start_after, end_at], keys are listed in ascending order.
+    :param client: S3Client
+    :param bucket: AWS S3 Bucket
+    :param prefix: AWS S3 file prefix
+    :param start_after: only keys after this key if not None
+    :param end_at: only keys up to and including this key if not None
+    :return: iterator of AWS S3 files' full path
+    """
+    paginator = client.get_paginator('list_objects_v2')
+    kwargs = {'StartAfter': start_after} if start_after is not None else {}
+    pages = paginator.paginate(Bucket=bucket, Prefix=prefix, PaginationConfig={'PageSize': 1000}, **kwargs)
+    for page in pages:
+        keys = map(_get_key, page.get('Contents', ()))
+        if end_at is None:
+            yield from keys
+            continue
+        for key in keys:
+            if key > end_at:
+                return
+            yield key
+
+
 def list_keys_by_prefix(
         client: S3Client,
         bucket: str,
@@ -89,19 +399,75 @@ def list_keys_by_prefix(
 ) -> list[str]:
     """
     List keys in a S3 bucket with a single file prefix, each key is a file's full path.
-    Each list_objects_v2 request returns max 1000 keys, so use a while loop to get all keys under the prefix.
+    Each list_objects_v2 request returns max 1000 keys, so use a paginator to get all keys under the prefix.
     :param client: S3Client
     :param bucket: AWS S3 Bucket
     :param prefix: AWS S3 file prefix
     :return: list of AWS S3 files' full path
     """
     try:
-        resp = client.list_objects_v2(Bucket=bucket, Prefix=prefix)
-        keys: list[str] = [content.get('Key') for content in resp.get('Contents', [])]
+        return list(iter_keys_by_prefix(client, bucket, prefix))
+    except Exception as err:
+        print(f'Error {err}')
+        return []
+
+
+def list_keys_by_prefix_sharded(
+        client: S3Client,
+        bucket: str,
+        prefix: str,
+        alphabet: str = string.hexdigits[:16],
+        start_after: str | None = None,
+) -> list[str]:
+    """
+    List keys in a S3 bucket with a single file prefix, split into shards which are listed concurrently.
+    Pagination of one prefix is sequential, so the key space is split at prefix + each character of the alphabet,
+    each shard lists its own key range from its own starting point. Shards cover the whole key space,
+    so keys whose next character is not in the alphabet are still listed.
+    :param client: S3Client
+    :param bucket: AWS S3 Bucket
+    :param prefix: AWS S3 file prefix
+    :param alphabet: characters to split the key space after the prefix
+    :param start_after: only keys after this key if not None
+    :return: list of AWS S3 files' full path in ascending order
+    """
+    bounds = [prefix + char for char in sorted(set(alphabet))]
+    bounds = [bound for bound in bounds if start_after is None or bound > start_after]
+    ranges = list(zip([start_after, *bounds], [*bounds, None]))
 
-        while continuation_token := resp.get('NextContinuationToken'):
-            resp = client.list_objects_v2(Bucket=bucket, Prefix=prefix, ContinuationToken=continuation_token)
-            keys.extend(content.get('Key') for content in resp.get('Contents', []))
+    def list_range(key_range: tuple[str | None, str | None]) -> list[str]:
+        try:
+            return list(iter_keys_by_prefix(client, bucket, prefix, start_after=key_range[0], end_at=key_range[1]))
+        except Exception as err:
+            print(f'Error {err}')
+            return []
+
+    keys = []
+    with ThreadPoolExecutor(_pick_workers(len(ranges))) as executor:
+        for shard_keys in executor.map(list_range, ranges):
+            keys.extend(shard_keys)
+    return keys
+
+
+def _list_keys_by_prefix_auto(
+        client: S3Client,
+        bucket: str,
+        prefix: str,
+) -> list[str]:
+    """
+    List keys in a S3 bucket with a single file prefix, fetch the first page with one request,
+    only fan out to list_keys_by_prefix_sharded for the rest of the keys when the first page is truncated,
+    so small prefixes cost a single request.
+    :param client: S3Client
+    :param bucket: AWS S3 Bucket
+    :param prefix: AWS S3 file prefix
+    :return: list of AWS S3 files' full path
+    """
+    try:
+        resp = client.list_objects_v2(Bucket=bucket, Prefix=prefix, MaxKeys=1000)
+        keys: list[str] = list(map(_get_key, resp.get('Contents', ())))
+        if resp.get('IsTruncated') and keys:
+            keys.extend(list_keys_by_prefix_sharded(client, bucket, prefix, start_after=keys[-1]))
         return keys
     except Exception as err:
         print(f'Error {err}')
@@ -114,26 +480,24 @@ def list_keys_by_prefixes(
 ) -> list[str]:
     """
     List keys in a S3 bucket with multiple file prefixes.
-    Use concurrent with max 16 workers to speed up.
-    Reuse same client to avoid cost of create and close a client.
+    Use concurrent with max MAX_WORKERS workers to speed up,
+    a single prefix with more than one page of keys is listed by shards concurrently.
+    Reuse the shared client to avoid cost of create and close a client.
     :param bucket: AWS S3 Bucket
     :param prefixes: list of AWS S3 file prefix
     :return: list of AWS S3 files' full path
     """
     if len(prefixes) > 0:
-        client = create_s3_client()
-        try:
-            func: Callable = partial(list_keys_by_prefix, client, bucket)
-            max_workers = 16
-            keys = []
-
-            with ThreadPoolExecutor(min(max_workers, len(prefixes))) as executor:
-                jobs = [executor.submit(func, prefix) for prefix in prefixes]
-                jobs_iter = tqdm(as_completed(jobs), total=len(prefixes), desc='List keys by prefixes')
-                for job in jobs_iter:
-                    keys.extend(job.result())
-        finally:
-            client.close()
+        client = get_s3_client()
+        func: Callable = partial(list_keys_by_prefix if len(prefixes) > 1 else _list_keys_by_prefix_auto,
+                                 client, bucket)
+        keys = []
+
+        with ThreadPoolExecutor(_pick_workers(len(prefixes))) as executor:
+            jobs = [executor.submit(func, prefix) for prefix in prefixes]
+            jobs_iter = progress_bar(as_completed(jobs), total=len(prefixes), desc='List keys by prefixes')
+            for job in jobs_iter:
+                keys.extend(job.result())
         return keys
 
 
@@ -141,92 +505,228 @@ def download_by_key(
         client: S3Client,
         bucket: str,
         key: str,
-        output_format: Literal['dict', 'bytes'] = 'dict',
+        output_format: Literal['dict', 'bytes', 'ndjson'] = 'dict',
         output_dir: str | None = '',
-) -> dict | None:
+) -> tuple[str, dict | bytes | int] | None:
     """
     Download a single AWS S3 file per the bucket and key (file full path).
-    Return a dict which key is the file full path and value is the data in the file.
+    Return a tuple of the file full path and the data in the file.
     Choose the value format as dict of the data, or the bytes of the data.
+    The dict is decoded by the stdlib json module, or by orjson if S3_READER_ORJSON is set,
+    which decodes integers of 2 ** 64 or more as float.
+    Use a single get_object request, the transfer manager of download_fileobj is not worth it for small files.
+    If output_format is bytes and output_dir is not None, the body is streamed to the file without keeping it in memory,
+    and the value is the number of bytes written. The file only appears under its key name once fully downloaded.
+    If output_format is ndjson, the data is appended as one line to the shard file of the current thread
+    in output_dir, and the value is the number of bytes written including the newline. Trailing newlines are stripped,
+    single-line JSON is written without decoding, multi-line JSON is decoded and re-encoded on one line,
+    empty or invalid multi-line data fails the key. Call close_ndjson_shards(output_dir) when done.
     :param client: AWS S3 Bucket
     :param bucket: AWS S3 Bucket
     :param key: AWS S3 file's full path
-    :param output_format: dict or bytes
+    :param output_format: dict, bytes or ndjson
     :param output_dir: write to a directory if not None
-    :return: {key: json.loads(data)} or {key: data}
+    :return: (key, json.loads(data)), (key, data) or (key, size)
+    """
+    try:
+        _check_output(output_format, output_dir)
+        body = client.get_object(Bucket=bucket, Key=key)['Body']
+        if output_format == 'dict':
+            return key, _json_loads(body.read())
+        elif output_format == 'bytes':
+            if output_dir is None:
+                return key, body.read()
+            _makedirs(os.path.join(output_dir, os.path.dirname(key)))
+            with _open_part(os.path.join(output_dir, key)) as f:
+                shutil.copyfileobj(body, f, MB)
+                return key, f.tell()
+        else:
+            data = body.read().rstrip(b'\r\n')
+            if not data:
+                raise ValueError(f'{key} is empty, can not be written as a ndjson line')
+            if b'\n' in data:
+                data = _json_compact(data)
+            f = _get_ndjson_shard(output_dir)
+            f.write(data)
+            f.write(b'\n')
+            return key, len(data) + 1
+    except Exception as err:
+        print(err)
+        return
+
+
+def download_large_by_key(
+        client: S3Client,
+        bucket: str,
+        key: str,
+        output_dir: str = '',
+        max_concurrency: int = 8,
+) -> str | None:
+    """
+    Download a single large AWS S3 file per the bucket and key (file full path) into a directory.
+    Objects above 8 MB are fetched as 16 MB byte-range GETs in parallel to exceed the per-connection throughput.
+    :param client: S3Client
+    :param bucket: AWS S3 Bucket
+    :param key: AWS S3 file's full path
+    :param output_dir: directory to write the file
+    :param max_concurrency: max number of parallel range GETs for this file
+    :return: local file path
     """
     try:
-        with BytesIO() as buf:
-            client.download_fileobj(Bucket=bucket, Key=key, Fileobj=buf)
-            buf.seek(0)
-            data = buf.read()
-            if output_format == 'dict':
-                return {key: json.loads(data)}
-            elif output_format == 'bytes':
-                if output_dir is not None:
-                    os.makedirs(os.path.join(output_dir, os.path.dirname(key)), exist_ok=True)
-                    with open(os.path.join(output_dir, key), 'wb') as f:
-                        f.write(data)
-                return {key: data}
-            else:
-                raise ValueError('output_format must be "dict" or "bytes"')
+        config = TransferConfig(
+            multipart_threshold=8 * MB,
+            multipart_chunksize=16 * MB,
+            max_concurrency=max_concurrency,
+            max_io_queue=1000,
+            io_chunksize=1 * MB,
+        )
+        path = os.path.join(output_dir, key)
+        _makedirs(os.path.dirname(path))
+        with _open_part(path) as f:
+            client.download_fileobj(Bucket=bucket, Key=key, Fileobj=f, Config=config)
+        return path
     except Exception as err:
         print(err)
         return
 
 
+def download_large_by_keys(
+        bucket: str,
+        keys: list[str],
+        output_dir: str = '',
+        max_concurrency: int = 2,
+) -> list[str]:
+    """
+    Download many large AWS S3 files per the bucket and keys (file full path) into a directory.
+    Each file uses max_concurrency range GETs, the number of files downloaded at the same time is reduced
+    so that files * range GETs stays within the connection pool.
+    :param bucket: AWS S3 Bucket
+    :param keys: list of AWS S3 file paths
+    :param output_dir: directory to write the files
+    :param max_concurrency: max number of parallel range GETs per file, at least 1
+    :return: list of local file paths
+    """
+    if max_concurrency < 1:
+        raise ValueError('max_concurrency must be at least 1')
+    paths = []
+    if len(keys) > 0:
+        client = get_s3_client()
+        func: Callable = partial(download_large_by_key, client, bucket,
+                                 output_dir=output_dir, max_concurrency=max_concurrency)
+        max_workers = _pick_workers(len(keys), MAX_WORKERS // max_concurrency)
+
+        with ThreadPoolExecutor(max_workers) as executor:
+            with progress_bar(total=len(keys), desc='Download large file by keys') as progress:
+                for _, path in _map_bounded(executor, func, keys, 4 * max_workers):
+                    if path is not None:
+                        paths.append(path)
+                    progress.update()
+    return paths
+
+
 def download_by_keys(
         bucket: str,
         keys: list[str],
-        output_format: Literal['dict', 'bytes'] = 'dict',
+        output_format: Literal['dict', 'bytes', 'ndjson'] = 'dict',
         output_dir: str | None = '',
-) -> dict[str, dict | bytes]:
+) -> dict[str, dict | bytes | int | None]:
     """
     Download many AWS S3 files per the bucket and keys (file full path).
-    Return a list of dict, for each item the key is the file full path and value is the data in the file.
+    Return a dict, the key is the file full path and value is the data in the file, or None if the download failed.
     Choose the value format as dict of the data, or the bytes of the data.
+    If output_format is bytes and output_dir is not None, the value is the number of bytes written instead.
+    If output_format is ndjson, files are appended to one shard file per worker thread in output_dir,
+    and the value is the number of bytes written. Shards are appended to, so clear output_dir before a rerun.
+    The dict is pre-sized with all keys to avoid rehashing while results come in.
     :param bucket: AWS S3 Bucket
     :param keys: list of AWS S3 file paths
-    :param output_format: dict or bytes
+    :param output_format: dict, bytes or ndjson
     :param output_dir: write to a directory if not None
-    :return: list of {key: data}
+    :return: dict of {key: data}
     """
+    _check_output(output_format, output_dir)
     if len(keys) > 0:
-        client = create_s3_client()
+        client = get_s3_client()
+        func: Callable = partial(download_by_key, client, bucket,
+                                 output_format=output_format, output_dir=output_dir)
+        max_workers = _pick_workers(len(keys))
+        data = dict.fromkeys(keys)
+
         try:
-            func: Callable = partial(download_by_key, client, bucket,
-                                     output_format=output_format, output_dir=output_dir)
-            max_workers = 16
-            data = {}
-
-            with ThreadPoolExecutor(min(max_workers, len(keys))) as executor:
-                jobs = [executor.submit(func, key) for key in keys]
-                jobs_iter = tqdm(as_completed(jobs), total=len(keys), desc='Download file by keys')
-                for job in jobs_iter:
-                    data.update(job.result())
+            with ThreadPoolExecutor(max_workers) as executor:
+                with progress_bar(total=len(keys), desc='Download file by keys') as progress:
+                    for key, result in _map_bounded(executor, func, keys, 4 * max_workers):
+                        if result is not None:
+                            data[key] = result[1]
+                        progress.update()
         finally:
-            client.close()
+            if output_format == 'ndjson':
+                close_ndjson_shards(output_dir)
         return data
 
 
 def download_by_prefixes(
         bucket: str,
         prefixes: list[str],
-        output_format: Literal['dict', 'bytes'] = 'dict',
+        output_format: Literal['dict', 'bytes', 'ndjson'] = 'dict',
         output_dir: str | None = '',
-) -> dict[str, dict | bytes]:
+) -> dict[str, dict | bytes | int | None]:
     """
     Download many AWS S3 files per the bucket and prefixes.
-    First get the keys as a list, then download the keys and return a dict with {key: data},
-    data format is decided by output_format.
+    Prefixes are listed by a few listing workers which put keys into a bounded queue,
+    download workers take keys from the queue, so downloads start as soon as the first page of keys returns
+    and memory does not grow with the number of keys. Listing and download workers share one connection pool,
+    sized so that each worker has its own connection.
+    The downloaded data is returned as a dict with {key: data}, data format is decided by output_format,
+    the value is None if the download failed, same as download_by_keys.
     If output_format is bytes, the data will be written in a folder
     per the dirname of the key under current working directory.
+    If output_format is ndjson, the data will be appended to one shard file per worker thread in output_dir,
+    shards are appended to, so clear output_dir before a rerun.
     :param bucket: AWS S3 Bucket
     :param prefixes: list of AWS S3 file prefix
-    :param output_format: dict or bytes
+    :param output_format: dict, bytes or ndjson
     :param output_dir: write to a directory if not None
-    :return: dict[]
+    :return: dict of {key: data}
     """
-    keys = list_keys_by_prefixes(bucket=bucket, prefixes=prefixes)
-    data = download_by_keys(bucket=bucket, keys=keys, output_format=output_format, output_dir=output_dir)
+    _check_output(output_format, output_dir)
+    data = {}
+    if len(prefixes) > 0:
+        list_workers = _pick_workers(len(prefixes), MAX_WORKERS // 2)
+        max_workers = _pick_workers(MAX_WORKERS - list_workers)
+        client = get_s3_client(max_pool_connections=list_workers + max_workers)
+        key_queue: Queue[str | None] = Queue(maxsize=1024)
+
+        def produce(prefix: str):
+            try:
+                for key in iter_keys_by_prefix(client, bucket, prefix):
+                    key_queue.put(key)
+            except Exception as err:
+                print(f'Error {err}')
+
+        def consume(progress: tqdm) -> dict[str, dict | bytes | int | None]:
+            consumed = {}
+            while (key := key_queue.get()) is not None:
+                result = download_by_key(client, bucket, key, output_format=output_format, output_dir=output_dir)
+                consumed[key] = result[1] if result is not None else None
+                progress.update()
+            return consumed
+
+        progress = progress_bar(desc='Download file by prefixes')
+        try:
+            with ThreadPoolExecutor(max_workers) as executor:
+                jobs = [executor.submit(consume, progress) for _ in range(max_workers)]
+                try:
+                    with ThreadPoolExecutor(list_workers) as list_executor:
+                        for _ in list_executor.map(produce, prefixes):
+                            pass
+                finally:
+                    for _ in range(max_workers):
+                        key_queue.put(None)
+                for job in as_completed(jobs):
+                    data.update(job.result())
+        finally:
+            progress.close()
+            if output_format == 'ndjson':
+                close_ndjson_shards(output_dir)
     return data